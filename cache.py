@@ -0,0 +1,150 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+import orjson
+
+logger = logging.getLogger(__name__)
+
+# --- Shared cache configuration ---
+# With REDIS_URL set, cached values are shared by every worker; otherwise they stay in-process
+REDIS_URL = os.getenv("REDIS_URL")
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "32"))
+REDIS_TIMEOUT = float(os.getenv("REDIS_TIMEOUT", "0.5"))  # seconds, for connect and each command
+# After repeated Redis failures, use only the in-process cache for a cool-down
+REDIS_BREAKER_THRESHOLD = 3
+REDIS_BREAKER_COOLDOWN = 30  # seconds
+LOCAL_CACHE_SIZE = 1024
+
+_redis = None
+_redis_lock = threading.Lock()
+_redis_failures = 0
+_redis_open_until = 0.0
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after a time-to-live"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # key -> (expires_at, value), least recently used first
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or time.monotonic() >= entry[0]:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def get_stale(self, key, default=None):
+        """Return a value even if it has expired; not counted as a hit or miss"""
+        with self._lock:
+            entry = self._data.get(key)
+        return default if entry is None else entry[1]
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            size, hits, misses = len(self._data), self.hits, self.misses
+        lookups = hits + misses
+        return {
+            "size": size,
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / lookups, 3) if lookups else None
+        }
+
+_local_cache = TTLCache(LOCAL_CACHE_SIZE, 60 * 60)
+
+def get_redis():
+    """Lazy load the Redis client; None when REDIS_URL is unset or redis is not installed"""
+    global _redis
+    if not REDIS_URL:
+        return None
+    if _redis is None:
+        with _redis_lock:
+            if _redis is None:
+                try:
+                    import redis
+                except ImportError:
+                    logger.warning("REDIS_URL is set but the redis package is not installed")
+                    return None
+                pool = redis.BlockingConnectionPool.from_url(
+                    REDIS_URL,
+                    max_connections=REDIS_MAX_CONNECTIONS,
+                    timeout=REDIS_TIMEOUT,  # wait for a free pooled connection
+                    socket_timeout=REDIS_TIMEOUT,
+                    socket_connect_timeout=REDIS_TIMEOUT
+                )
+                _redis = redis.Redis(connection_pool=pool)
+    return _redis
+
+def _record_redis_outcome(ok):
+    global _redis_failures, _redis_open_until
+    with _redis_lock:
+        if ok:
+            _redis_failures = 0
+            return
+        _redis_failures += 1
+        if _redis_failures >= REDIS_BREAKER_THRESHOLD:
+            _redis_failures = 0
+            _redis_open_until = time.monotonic() + REDIS_BREAKER_COOLDOWN
+            logger.warning("Redis unavailable; using the local cache only for %ss", REDIS_BREAKER_COOLDOWN)
+
+def _available_redis():
+    """The Redis client, or None when unconfigured or its circuit is open"""
+    if time.monotonic() < _redis_open_until:
+        return None
+    return get_redis()
+
+def get_or_set(key, ttl, fn, local=None):
+    """Return the cached value for key, or compute it with fn() and cache it for ttl seconds.
+
+    Looks in the in-process cache first, then Redis when configured. None results are not cached.
+    """
+    local = _local_cache if local is None else local
+    value = local.get(key)
+    if value is not None:
+        return value
+
+    client = _available_redis()
+    if client is not None:
+        try:
+            raw = client.get(key)
+            _record_redis_outcome(True)
+            if raw is not None:
+                value = orjson.loads(raw)
+                local.set(key, value, ttl)
+                return value
+        except Exception as e:
+            _record_redis_outcome(False)
+            client = None
+            logger.warning("Redis get failed for %s: %s", key, e)
+
+    value = fn()
+    if value is None:
+        return None
+    local.set(key, value, ttl)
+    if client is not None:
+        try:
+            client.setex(key, ttl, orjson.dumps(value))
+            _record_redis_outcome(True)
+        except Exception as e:
+            _record_redis_outcome(False)
+            logger.warning("Redis set failed for %s: %s", key, e)
+    return value
@@ -1,13 +1,15 @@
 import azure.functions as func
 import requests
 import json
+import orjson
 import logging
 import base64
 from session_store import (
     create_session, get_session, update_session, clear_session, 
     authenticate_user, get_latest_user_session, get_user_by_username,
     create_user, get_user_sessions, get_user_by_id,
-    get_container, get_users_container
+    get_container, get_users_container, delete_username_index,
+    ensure_default_users
 )
 
 import logging, os, json
@@ -15,7 +17,7 @@ from azure.storage.blob import BlobServiceClient, ContentSettings
 from datetime import datetime, timezone
 import uuid
 
-from tools import get_function_definitions, execute_function
+from tools import get_function_definitions, get_function_definitions_json, execute_functions, get_cache_stats, get_osm_stats
 
 # ADDED: retrieve_similar_docs import for context injection
 from rag_pipeline import generate_response_with_context, retrieve_similar_docs, index_all_blobs_stream, get_openai_client, AZURE_OPENAI_DEPLOYMENT
@@ -29,8 +31,16 @@ app = func.FunctionApp(http_auth_level=func.AuthLevel.FUNCTION)
 from datetime import datetime
 
 
+# Verbosity of the app's own module loggers; the Functions host owns the root logger
+LOG_LEVEL = os.getenv("LOG_LEVEL", "WARNING").upper()
+for _logger_name in ("session_store", "rag_pipeline", "speech_interface", "tools", "cache"):
+    logging.getLogger(_logger_name).setLevel(LOG_LEVEL)
+
 logging.info("Function app started - lazy loading enabled")
 
+# Create default users once at startup (set SKIP_USER_INIT to disable, e.g. in CI)
+ensure_default_users()
+
 # ADDED: Helper to inject RAG context for every query
 def build_rag_context_message(user_text: str, top_k: int = 3):
     """
@@ -236,6 +246,7 @@ def chat(req: func.HttpRequest) -> func.HttpResponse:
         ai_reply = None
         references = []
         audio_response_base64 = None
+        client = None
 
         # Get session history for context
         session = get_session(session_id)
@@ -268,7 +279,7 @@ def chat(req: func.HttpRequest) -> func.HttpResponse:
                     temperature=0.7,
                 )
 
-                logging.info(f"[DEBUG] Tools passed to model: {get_function_definitions()}")
+                logging.info(f"[DEBUG] Tools passed to model: {get_function_definitions_json()}")
 
                 response_message = first_response.choices[0].message
                 tool_calls = response_message.tool_calls
@@ -280,19 +291,20 @@ def chat(req: func.HttpRequest) -> func.HttpResponse:
                     # Add the assistant's message with tool calls to history
                     messages.append(response_message)
                     
-                    # Step 3: Execute each function call
-                    for tool_call in tool_calls:
-                        function_name = tool_call.function.name
-                        function_args = json.loads(tool_call.function.arguments or "{}")
-                        
-                        # Execute the function using the centralized function with session_id
-                        function_response = execute_function(function_name, function_args, session_id)
-                        
+                    # Step 3: Execute the function calls; independent ones run in parallel
+                    calls = [
+                        (tool_call.function.name, json.loads(tool_call.function.arguments or "{}"))
+                        for tool_call in tool_calls
+                    ]
+                    function_responses = execute_functions(calls, session_id)
+                    
+                    for tool_call, function_response in zip(tool_calls, function_responses):
                         # Add function response to messages
                         messages.append({
                             "role": "tool",
                             "tool_call_id": tool_call.id,
-                            "content": json.dumps(function_response)
+                            # orjson serializes the Place dataclasses in tool results directly
+                            "content": orjson.dumps(function_response).decode()
                         })
                     
                     # Step 4: Second API call with function results
@@ -317,7 +329,8 @@ def chat(req: func.HttpRequest) -> func.HttpResponse:
                 references = rag_response.get("references", [])
 
         # --- Update session ---
-        update_session(session_id, user_text, ai_reply, user_id=user_id)
+        # With the OpenAI client, long histories are summarized before older turns are dropped
+        update_session(session_id, user_text, ai_reply, user_id=user_id, client_openai=client, deployment=AZURE_OPENAI_DEPLOYMENT)
 
         # --- TTS output ---
         if ai_reply and not ai_reply.startswith("I couldn't"):
@@ -459,8 +472,8 @@ def admin_users(req: func.HttpRequest) -> func.HttpResponse:
                 headers={"Access-Control-Allow-Origin": "*"},
             )
 
-        # Get all users from users container
-        query = "SELECT * FROM c"
+        # Get all users from users container (skip username pointer documents)
+        query = "SELECT * FROM c WHERE IS_DEFINED(c.username)"
         users = list(get_users_container().query_items(
             query=query,
             enable_cross_partition_query=True
@@ -714,6 +727,8 @@ def admin_delete_user(req: func.HttpRequest) -> func.HttpResponse:
             logging.info(f"[DeleteUser] Deleting user: id={doc_id}, partition_key={partition_key}")
             get_users_container().delete_item(item=doc_id, partition_key=partition_key)
             logging.info(f"[DeleteUser] User deleted: {doc_id}")
+            if user.get("username"):
+                delete_username_index(user["username"])
         except Exception as e:
             logging.error(f"[DeleteUser] Failed to delete user: {e}")
             import traceback
@@ -774,6 +789,35 @@ def health_check(req: func.HttpRequest) -> func.HttpResponse:
         headers={"Access-Control-Allow-Origin": "*"},
     )
 
+@app.route(route="management/metrics", methods=["GET", "OPTIONS"])
+def admin_metrics(req: func.HttpRequest) -> func.HttpResponse:
+    """Tool cache and OSM request counters for this worker"""
+    if req.method == "OPTIONS":
+        return func.HttpResponse(
+            status_code=204,
+            headers={
+                "Access-Control-Allow-Origin": "*",
+                "Access-Control-Allow-Methods": "GET, OPTIONS",
+                "Access-Control-Allow-Headers": "Content-Type, Authorization",
+            },
+        )
+
+    auth_header = req.headers.get('Authorization', '')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return func.HttpResponse(
+            json.dumps({"error": "Unauthorized"}),
+            status_code=401,
+            mimetype="application/json",
+            headers={"Access-Control-Allow-Origin": "*"},
+        )
+
+    return func.HttpResponse(
+        json.dumps({"caches": get_cache_stats(), "osm": get_osm_stats()}),
+        status_code=200,
+        mimetype="application/json",
+        headers={"Access-Control-Allow-Origin": "*"},
+    )
+
 @app.route(route="management/stats", methods=["GET", "OPTIONS"])
 def admin_stats(req: func.HttpRequest) -> func.HttpResponse:
     if req.method == "OPTIONS":
@@ -798,7 +842,7 @@ def admin_stats(req: func.HttpRequest) -> func.HttpResponse:
             )
 
         # Get user count
-        users_query = "SELECT VALUE COUNT(1) FROM c"
+        users_query = "SELECT VALUE COUNT(1) FROM c WHERE IS_DEFINED(c.username)"
         users_count = list(get_users_container().query_items(
             query=users_query,
             enable_cross_partition_query=True
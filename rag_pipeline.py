@@ -1,5 +1,8 @@
 import os
 import re
+import logging
+import threading
+import numpy as np
 from openai import AzureOpenAI
 from azure.search.documents import SearchClient
 from azure.search.documents.indexes import SearchIndexClient
@@ -26,6 +29,8 @@ sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # --- Load non-sensitive values from .env ---
 KEYVAULT_NAME = os.getenv("KEYVAULT_NAME")  
 AZURE_OPENAI_ENDPOINT = os.getenv("ENDPOINT_URL")
@@ -36,6 +41,9 @@ SEARCH_INDEX = os.getenv("AZURE_INDEX_NAME", "document-index")
 TOP_K = 3
 BLOB_CONTAINER = os.getenv("BLOB_CONTAINER_NAME")
 DOC_INTELLIGENCE_ENDPOINT = os.getenv("DOC_INTELLIGENCE_ENDPOINT")  
+# Answers reused for paraphrased questions whose embeddings are this similar
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "1024"))
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
 
 # --- Cache for secrets and clients ---
 _openai_key = None
@@ -55,10 +63,10 @@ def get_openai_key():
         # Try environment variable first
         _openai_key = os.getenv("AZURE_OPENAI_API_KEY")
         if _openai_key:
-            print("Using OpenAI key from environment variable")
+            logger.debug("Using OpenAI key from environment variable")
             return _openai_key
             
-        print("OpenAI key not found in environment, trying Key Vault...")
+        logger.info("OpenAI key not found in environment, trying Key Vault...")
         
         # Fall back to Key Vault
         try:
@@ -66,10 +74,10 @@ def get_openai_key():
             credential = DefaultAzureCredential()
             secret_client = SecretClient(vault_url=keyvault_url, credential=credential)
             _openai_key = secret_client.get_secret("AZURE-OPENAI-KEY").value
-            print("Successfully fetched OpenAI key from Key Vault")
+            logger.info("Successfully fetched OpenAI key from Key Vault")
         except Exception as e:
-            print(f"Error fetching OpenAI key from Key Vault: {e}")
-            print("Make sure AZURE_OPENAI_KEY is set in local.settings.json")
+            logger.error("Error fetching OpenAI key from Key Vault: %s", e)
+            logger.error("Make sure AZURE_OPENAI_KEY is set in local.settings.json")
             raise ValueError("Could not get OpenAI key from environment or Key Vault")
     return _openai_key
 
@@ -79,20 +87,20 @@ def get_search_key():
         # Try environment variable first
         _search_key = os.getenv("AZURE_SEARCH_KEY")
         if _search_key:
-            print("Using Search key from environment variable")
+            logger.debug("Using Search key from environment variable")
             return _search_key
             
-        print("Search key not found in environment, trying Key Vault...")
+        logger.info("Search key not found in environment, trying Key Vault...")
         
         try:
             keyvault_url = f"https://{KEYVAULT_NAME}.vault.azure.net/"
             credential = DefaultAzureCredential()
             secret_client = SecretClient(vault_url=keyvault_url, credential=credential)
             _search_key = secret_client.get_secret("AZURE-SEARCH-KEY").value
-            print("Successfully fetched Search key from Key Vault")
+            logger.info("Successfully fetched Search key from Key Vault")
         except Exception as e:
-            print(f"Error fetching Search key from Key Vault: {e}")
-            print("Make sure AZURE_SEARCH_KEY is set in local.settings.json")
+            logger.error("Error fetching Search key from Key Vault: %s", e)
+            logger.error("Make sure AZURE_SEARCH_KEY is set in local.settings.json")
             raise ValueError("Could not get Search key from environment or Key Vault")
     return _search_key
 
@@ -102,20 +110,20 @@ def get_doc_intelligence_key():
         # Try environment variable first
         _doc_intelligence_key = os.getenv("DOC_INTELLIGENCE_KEY")
         if _doc_intelligence_key:
-            print("Using Document Intelligence key from environment variable")
+            logger.debug("Using Document Intelligence key from environment variable")
             return _doc_intelligence_key
             
-        print("Document Intelligence key not found in environment, trying Key Vault...")
+        logger.info("Document Intelligence key not found in environment, trying Key Vault...")
         
         try:
             keyvault_url = f"https://{KEYVAULT_NAME}.vault.azure.net/"
             credential = DefaultAzureCredential()
             secret_client = SecretClient(vault_url=keyvault_url, credential=credential)
             _doc_intelligence_key = secret_client.get_secret("DOC-INTELLIGENCE-KEY").value
-            print("Successfully fetched Document Intelligence key from Key Vault")
+            logger.info("Successfully fetched Document Intelligence key from Key Vault")
         except Exception as e:
-            print(f"Error fetching Document Intelligence key from Key Vault: {e}")
-            print("Make sure DOC_INTELLIGENCE_KEY is set in local.settings.json")
+            logger.error("Error fetching Document Intelligence key from Key Vault: %s", e)
+            logger.error("Make sure DOC_INTELLIGENCE_KEY is set in local.settings.json")
             raise ValueError("Could not get Document Intelligence key from environment or Key Vault")
     return _doc_intelligence_key
 
@@ -125,20 +133,20 @@ def get_blob_connection_string():
         # Try environment variable first
         _blob_connection_string = os.getenv("BLOB_CONNECTION_STRING")
         if _blob_connection_string:
-            print("Using Blob connection string from environment variable")
+            logger.debug("Using Blob connection string from environment variable")
             return _blob_connection_string
             
-        print("Blob connection string not found in environment, trying Key Vault...")
+        logger.info("Blob connection string not found in environment, trying Key Vault...")
         
         try:
             keyvault_url = f"https://{KEYVAULT_NAME}.vault.azure.net/"
             credential = DefaultAzureCredential()
             secret_client = SecretClient(vault_url=keyvault_url, credential=credential)
             _blob_connection_string = secret_client.get_secret("BLOB-CONNECTION-STRING").value
-            print("Successfully fetched Blob connection string from Key Vault")
+            logger.info("Successfully fetched Blob connection string from Key Vault")
         except Exception as e:
-            print(f"Error fetching Blob connection string from Key Vault: {e}")
-            print("Make sure BLOB_CONNECTION_STRING is set in local.settings.json")
+            logger.error("Error fetching Blob connection string from Key Vault: %s", e)
+            logger.error("Make sure BLOB_CONNECTION_STRING is set in local.settings.json")
             raise ValueError("Could not get Blob connection string from environment or Key Vault")
     return _blob_connection_string
 
@@ -197,7 +205,7 @@ def get_container_client():
 def create_search_index(index_name: str):
     existing_indexes = [idx.name for idx in get_index_client().list_indexes()]
     if index_name in existing_indexes:
-        print(f"[INFO] Index '{index_name}' already exists. Skipping creation.")
+        logger.info("Index '%s' already exists. Skipping creation.", index_name)
         return
 
     fields = [
@@ -233,9 +241,9 @@ def create_search_index(index_name: str):
         vector_search=vector_search
     )
 
-    print(f"[INFO] Creating index '{index_name}'...")
+    logger.info("Creating index '%s'...", index_name)
     get_index_client().create_index(index)
-    print(f"[SUCCESS] Index '{index_name}' created!")
+    logger.info("[SUCCESS] Index '%s' created!", index_name)
 
 def embed_query(query: str):
     resp = get_openai_client().embeddings.create(
@@ -252,7 +260,7 @@ def make_safe_id(file_name: str, chunk_idx: int) -> str:
     return f"doc_{clean}_chunk_{chunk_idx}"
 
 def index_all_blobs_stream(chunk_size: int = 400):
-    print("[INFO] Indexing all documents from Blob Storage (if not already indexed)...")
+    logger.info("Indexing all documents from Blob Storage (if not already indexed)...")
     create_search_index(SEARCH_INDEX)
     summary = []
 
@@ -265,7 +273,7 @@ def index_all_blobs_stream(chunk_size: int = 400):
                 top=1
             )
             if any(True for _ in results):
-                print(f"[SKIP] Already indexed: {blob_name}")
+                logger.info("[SKIP] Already indexed: %s", blob_name)
                 summary.append({"file": blob_name, "status": "skipped"})
                 continue
 
@@ -280,13 +288,13 @@ def index_all_blobs_stream(chunk_size: int = 400):
                 result = poller.result()
                 text = "\n".join([line.content for page in result.pages for line in page.lines])
             else:
-                print(f"[SKIP] Unsupported file type: {blob_name}")
+                logger.info("[SKIP] Unsupported file type: %s", blob_name)
                 summary.append({"file": blob_name, "status": "unsupported"})
                 continue
 
             text = re.sub(r"\s+", " ", text).strip()
             if not text:
-                print(f"[SKIP] No text extracted from {blob_name}")
+                logger.info("[SKIP] No text extracted from %s", blob_name)
                 summary.append({"file": blob_name, "status": "no_text"})
                 continue
 
@@ -302,16 +310,69 @@ def index_all_blobs_stream(chunk_size: int = 400):
                     "chunk": chunk,
                     "text_vector": vector
                 }])
-                print(f"[INDEXED] {chunk_id} from {blob_name}")
+                logger.debug("[INDEXED] %s from %s", chunk_id, blob_name)
             summary.append({"file": blob_name, "status": "indexed"})
         except Exception as e:
-            print(f"[ERROR] Failed to index {blob_name}: {e}")
+            logger.error("Failed to index %s: %s", blob_name, e)
             summary.append({"file": blob_name, "status": "error", "error": str(e)})
 
+    # Cached answers may be grounded in documents that changed or were removed
+    clear_semantic_cache()
     return summary
 
-def retrieve_similar_docs(query: str, top_k: int = TOP_K):
-    query_vector = embed_query(query)
+# --- Semantic answer cache ---
+_semantic_vectors = None  # (SEMANTIC_CACHE_SIZE, dim) unit-length query embeddings
+_semantic_top_k = None  # (SEMANTIC_CACHE_SIZE,) top_k each cached response was built with
+_semantic_payloads = []  # (top_k, response) for each filled row
+_semantic_next = 0  # ring-buffer slot overwritten next
+_semantic_lock = threading.Lock()
+
+def _unit_vector(embedding):
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+def _semantic_lookup(vector, top_k):
+    """Cached response for the most similar earlier query with the same top_k, if close enough"""
+    with _semantic_lock:
+        filled = len(_semantic_payloads)
+        if not filled:
+            return None
+        scores = _semantic_vectors[:filled] @ vector
+        # Answers built from a different number of documents never match
+        scores[_semantic_top_k[:filled] != top_k] = -np.inf
+        best = int(np.argmax(scores))
+        response = _semantic_payloads[best][1]
+        if scores[best] >= SEMANTIC_CACHE_THRESHOLD:
+            logger.debug("Semantic cache hit (similarity %.3f)", scores[best])
+            return dict(response)
+    return None
+
+def _semantic_store(vector, top_k, response):
+    global _semantic_vectors, _semantic_top_k, _semantic_next
+    with _semantic_lock:
+        if _semantic_vectors is None:
+            _semantic_vectors = np.zeros((SEMANTIC_CACHE_SIZE, vector.shape[0]), dtype=np.float32)
+            _semantic_top_k = np.zeros(SEMANTIC_CACHE_SIZE, dtype=np.int64)
+        slot = _semantic_next
+        _semantic_vectors[slot] = vector
+        _semantic_top_k[slot] = top_k
+        if slot < len(_semantic_payloads):
+            _semantic_payloads[slot] = (top_k, response)
+        else:
+            _semantic_payloads.append((top_k, response))
+        _semantic_next = (slot + 1) % SEMANTIC_CACHE_SIZE
+
+def clear_semantic_cache():
+    """Drop every cached answer, e.g. after the search index changes"""
+    global _semantic_next
+    with _semantic_lock:
+        _semantic_payloads.clear()
+        _semantic_next = 0
+
+def retrieve_similar_docs(query: str, top_k: int = TOP_K, query_vector=None):
+    if query_vector is None:
+        query_vector = embed_query(query)
     vector_query = VectorizedQuery(
         kind="vector",
         vector=query_vector,
@@ -327,7 +388,14 @@ def retrieve_similar_docs(query: str, top_k: int = TOP_K):
     return docs
 
 def generate_response_with_context(query: str, top_k: int = TOP_K):
-    docs = retrieve_similar_docs(query, top_k=top_k)
+    # Embed once: the same vector probes the answer cache and the search index
+    query_embedding = embed_query(query)
+    unit_query = _unit_vector(query_embedding)
+    cached = _semantic_lookup(unit_query, top_k)
+    if cached is not None:
+        return cached
+
+    docs = retrieve_similar_docs(query, top_k=top_k, query_vector=query_embedding)
 
     context_text = ""
     for d in docs:
@@ -374,4 +442,6 @@ def generate_response_with_context(query: str, top_k: int = TOP_K):
     answer_text = completion.choices[0].message.content.strip()
     used_references = [d["title"] for d in docs if d["title"] in answer_text]
 
-    return {"answer": answer_text, "references": used_references}
\ No newline at end of file
+    response = {"answer": answer_text, "references": used_references}
+    _semantic_store(unit_query, top_k, response)
+    return dict(response)
\ No newline at end of file
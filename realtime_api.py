@@ -387,7 +387,8 @@ async def livechat_socket(websocket: WebSocket):
                                 parsed_args = json.loads(fn_args) if isinstance(fn_args, str) else fn_args
                             except Exception:
                                 parsed_args = fn_args
-                            result = execute_function(fn_name, parsed_args)
+                            # Tools do blocking HTTP; keep the event loop free for audio relay
+                            result = await asyncio.to_thread(execute_function, fn_name, parsed_args)
                             await gpt_ws.send(json.dumps({
                                 "type": "response.function_call_result",
                                 "call_id": call_id,
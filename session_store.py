@@ -1,27 +1,83 @@
 import os
+import json
+import asyncio
 import uuid
+import time
+import hashlib
+import logging
+import threading
 import bcrypt
 from datetime import datetime, timezone
+from functools import lru_cache
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from azure.cosmos import CosmosClient, exceptions
+from azure.cosmos import _synchronized_request
 from azure.keyvault.secrets import SecretClient
 from azure.identity import DefaultAzureCredential
 import tiktoken
+import orjson
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # --- Configuration ---
 KEYVAULT_NAME = os.getenv("KEYVAULT_NAME")
 COSMOS_URI = os.getenv("COSMOS_URI")
 COSMOS_DB_NAME = os.getenv("COSMOS_DB_NAME")
 COSMOS_CONTAINER_NAME = os.getenv("COSMOS_CONTAINER_NAME")
 COSMOS_USERS_CONTAINER_NAME = os.getenv("COSMOS_USERS_CONTAINER_NAME", "users")
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+# --- Fast JSON for Cosmos requests ---
+class _FastJson:
+    """Stand-in for the json module inside the Cosmos request module; parses with orjson"""
+
+    def __getattr__(self, name):
+        return getattr(json, name)
+
+    @staticmethod
+    def loads(s, *args, **kwargs):
+        if args or kwargs:
+            return json.loads(s, *args, **kwargs)
+        return orjson.loads(s)
+
+def _install_fast_json():
+    """Serialize and parse Cosmos request/response bodies with orjson instead of the stdlib json module"""
+    original = getattr(_synchronized_request, "_request_body_from_data", None)
+    if original is None or getattr(_synchronized_request, "json", None) is not json:
+        # SDK internals changed, keep the default serializer
+        return
+
+    def _request_body_from_data(data):
+        if isinstance(data, (dict, list, tuple)):
+            try:
+                # Compact UTF-8 bytes, no whitespace between separators
+                return orjson.dumps(data)
+            except TypeError:
+                return original(data)
+        return original(data)
+
+    _synchronized_request._request_body_from_data = _request_body_from_data
+    # Response bodies are parsed with the module's json.loads
+    _synchronized_request.json = _FastJson()
+
+_install_fast_json()
 
 # --- Lazy-loaded clients and secrets ---
 _cosmos_client = None
 _container = None
 _users_container = None
 _cosmos_key = None
+# Re-entrant: get_container() builds the client while holding the lock
+_init_lock = threading.RLock()
+_default_users_ready = False
+_default_users_retry_at = 0.0  # monotonic time before which a failed init is not retried
+_default_users_lock = threading.Lock()
+_system_prompts = OrderedDict()  # session_id -> system prompt, least recently used first
+_system_prompts_lock = threading.Lock()
 
 def get_cosmos_key():
     """Lazy load Cosmos DB key from environment first, then Key Vault"""
@@ -30,10 +86,10 @@ def get_cosmos_key():
         # Try environment variable first
         _cosmos_key = os.getenv("COSMOS_KEY")
         if _cosmos_key:
-            print("Using Cosmos key from environment variable")
+            logger.debug("Using Cosmos key from environment variable")
             return _cosmos_key
             
-        print("Cosmos key not found in environment, trying Key Vault...")
+        logger.info("Cosmos key not found in environment, trying Key Vault...")
         
         # Fall back to Key Vault
         try:
@@ -41,10 +97,10 @@ def get_cosmos_key():
             credential = DefaultAzureCredential()
             secret_client = SecretClient(vault_url=keyvault_url, credential=credential)
             _cosmos_key = secret_client.get_secret("COSMOS-KEY").value
-            print("✓ Successfully fetched Cosmos key from Key Vault")
+            logger.info("Successfully fetched Cosmos key from Key Vault")
         except Exception as e:
-            print(f"Error fetching Cosmos key from Key Vault: {e}")
-            print("Make sure COSMOS_KEY is set in local.settings.json")
+            logger.error("Error fetching Cosmos key from Key Vault: %s", e)
+            logger.error("Make sure COSMOS_KEY is set in local.settings.json")
             raise ValueError("Could not get Cosmos key from environment or Key Vault")
     return _cosmos_key
 
@@ -52,28 +108,56 @@ def get_cosmos_client():
     """Lazy load Cosmos client"""
     global _cosmos_client
     if _cosmos_client is None:
-        _cosmos_client = CosmosClient(url=COSMOS_URI, credential=get_cosmos_key())
+        with _init_lock:
+            if _cosmos_client is None:
+                _cosmos_client = CosmosClient(url=COSMOS_URI, credential=get_cosmos_key())
     return _cosmos_client
 
 def get_container():
     """Lazy load sessions container"""
     global _container
     if _container is None:
-        database = get_cosmos_client().get_database_client(COSMOS_DB_NAME)
-        _container = database.get_container_client(COSMOS_CONTAINER_NAME)
+        with _init_lock:
+            if _container is None:
+                database = get_cosmos_client().get_database_client(COSMOS_DB_NAME)
+                _container = database.get_container_client(COSMOS_CONTAINER_NAME)
     return _container
 
 def get_users_container():
     """Lazy load users container"""
     global _users_container
     if _users_container is None:
-        database = get_cosmos_client().get_database_client(COSMOS_DB_NAME)
-        _users_container = database.get_container_client(COSMOS_USERS_CONTAINER_NAME)
+        with _init_lock:
+            if _users_container is None:
+                database = get_cosmos_client().get_database_client(COSMOS_DB_NAME)
+                _users_container = database.get_container_client(COSMOS_USERS_CONTAINER_NAME)
     return _users_container
 
+def _reset_clients_after_fork():
+    """Forked workers must not share the parent's connection pool"""
+    global _cosmos_client, _container, _users_container, _init_lock
+    _cosmos_client = None
+    _container = None
+    _users_container = None
+    _init_lock = threading.RLock()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_clients_after_fork)
+
 # --- Constants ---
+# Prefix of the username -> user pointer documents in the users container
+USERNAME_INDEX_PREFIX = "username:"
+DEFAULT_USERS = (
+    ("admin", "admin123", "admin"),
+    ("client", "client123", "client"),
+)
+DEFAULT_USERS_RETRY_INTERVAL = 60  # seconds between default user init attempts after a failure
 MAX_TOKENS = 2000
 SUMMARY_TRIGGER = 10
+MAX_HISTORY = 20  # Recent messages kept after the system prompt and summary
+MAX_PATCH_OPERATIONS = 10  # Cosmos DB limit per patch request
+SYSTEM_PROMPT_CACHE_SIZE = 1024
+TOKENIZER_THREADS = min(4, os.cpu_count() or 1)
 DEFAULT_SYSTEM_PROMPT = (
     "You are an expert barista with deep knowledge of coffee, brewing methods, beans, and recipes. "
     "You have access to reference documents which may contain information relevant to the user's query. "
@@ -90,21 +174,94 @@ DEFAULT_SYSTEM_PROMPT = (
 )
 
 # Initialize default users
+def _username_index_id(username: str):
+    # Hashed: usernames may contain characters that are illegal in Cosmos ids, such as / ? #
+    return USERNAME_INDEX_PREFIX + hashlib.sha256(username.encode('utf-8')).hexdigest()
+
+def save_username_index(user):
+    """Write the pointer document that maps a username to its user document"""
+    index_id = _username_index_id(user["username"])
+    get_users_container().upsert_item({
+        "id": index_id,
+        "user_id": index_id,  # Pointer is its own partition
+        "ref_id": user["id"],
+        "ref_user_id": user["user_id"]
+    })
+
+def delete_username_index(username: str):
+    """Remove the username pointer document, if any"""
+    index_id = _username_index_id(username)
+    try:
+        get_users_container().delete_item(item=index_id, partition_key=index_id)
+    except exceptions.CosmosResourceNotFoundError:
+        pass
+
 def get_user_by_username(username: str):
     """Get user by username from users container"""
-    query = "SELECT * FROM c WHERE c.username = @username"
+    try:
+        return _find_user_by_username(username)
+    except Exception as e:
+        logger.error("Error querying user by username: %s", e)
+        return None
+
+def _find_user_by_username(username: str):
+    """Look up a user by username; None only when the user does not exist, raises on lookup errors"""
+    # Two point reads through the username pointer document
+    index_id = _username_index_id(username)
+    try:
+        pointer = get_users_container().read_item(item=index_id, partition_key=index_id)
+        return get_users_container().read_item(
+            item=pointer["ref_id"],
+            partition_key=pointer["ref_user_id"]
+        )
+    except exceptions.CosmosResourceNotFoundError:
+        # Every user has a pointer (written on insert, backfilled at startup), so a clean 404
+        # means no such user; skipping the query keeps unknown usernames as cheap as known ones
+        return None
+    except Exception as e:
+        # Throttled or failed point read; the query below can still find the user
+        logger.warning("Username pointer read failed, falling back to query: %s", e)
+
+    # Project only the fields needed for authentication
+    query = (
+        "SELECT c.id, c.user_id, c.username, c.password, c.role, c.created_at "
+        "FROM c WHERE c.username = @username"
+    )
     params = [{"name": "@username", "value": username}]
     
+    users = list(get_users_container().query_items(
+        query=query,
+        parameters=params,
+        enable_cross_partition_query=True
+    ))
+
+    if not users:
+        return None
+
+    # Backfill the pointer so the next lookup is a point read
     try:
-        users = list(get_users_container().query_items(
-            query=query,
-            parameters=params,
-            enable_cross_partition_query=True
-        ))
-        return users[0] if users else None
+        save_username_index(users[0])
     except Exception as e:
-        print(f"Error querying user by username: {e}")
-        return None
+        logger.warning("Could not save username index: %s", e)
+    return users[0]
+
+def _backfill_username_index():
+    """Write the pointer documents missing for users created before pointers existed"""
+    container = get_users_container()
+    indexed = {doc["id"] for doc in container.query_items(
+        query="SELECT c.id FROM c WHERE STARTSWITH(c.id, @prefix)",
+        parameters=[{"name": "@prefix", "value": USERNAME_INDEX_PREFIX}],
+        enable_cross_partition_query=True
+    )}
+    users = container.query_items(
+        query="SELECT c.id, c.user_id, c.username FROM c WHERE IS_DEFINED(c.username)",
+        enable_cross_partition_query=True
+    )
+    missing = [user for user in users if _username_index_id(user["username"]) not in indexed]
+    for user in missing:
+        save_username_index(user)
+    if missing:
+        logger.info("Backfilled %d username pointers", len(missing))
 
 def get_user_by_id(user_id: str):
     """Get user by ID from users container"""
@@ -117,58 +274,113 @@ def get_user_by_id(user_id: str):
     except exceptions.CosmosResourceNotFoundError:
         return None
     except Exception as e:
-        print(f"Error getting user by ID: {e}")
+        logger.error("Error getting user by ID: %s", e)
         return None
 
 def initialize_default_users():
-    """Create default admin and client users if they don't exist"""
+    """Create default admin and client users if they don't exist.
+
+    Returns False when any lookup or write fails, so the next call retries;
+    users are only created after a lookup confirms they are missing.
+    """
     try:
-        # Check if admin exists
-        admin = get_user_by_username("admin")
-        
-        if not admin:
-            create_user("admin", "admin123", "admin")
-            print("Created default admin user")
-        
-        # Check if client exists
-        client_user = get_user_by_username("client")
-        
-        if not client_user:
-            create_user("client", "client123", "client")
-            print("Created default client user")
+        # Logins treat a missing pointer as a missing user, so every user needs one first
+        _backfill_username_index()
+
+        # Look up all default users concurrently instead of one round-trip after another;
+        # lookup errors propagate instead of reading as "user missing"
+        with ThreadPoolExecutor(max_workers=len(DEFAULT_USERS)) as executor:
+            existing = list(executor.map(_find_user_by_username, [u[0] for u in DEFAULT_USERS]))
+
+        for (username, password, role), user in zip(DEFAULT_USERS, existing):
+            if user:
+                continue
+            # Deterministic id: concurrent cold starts cannot create duplicates
+            if _insert_user(username, password, role, user_id=f"user:{username}"):
+                logger.info("Created default %s user", username)
+        return True
             
     except Exception as e:
-        print(f"Error initializing users: {e}")
+        logger.error("Error initializing users: %s", e)
+        return False
+
+def ensure_default_users():
+    """Create the default users once per process; later calls return immediately.
+
+    A failed attempt is retried only after DEFAULT_USERS_RETRY_INTERVAL, and callers
+    never wait while another thread is initializing.
+    """
+    global _default_users_ready, _default_users_retry_at
+    if _default_users_ready or os.getenv("SKIP_USER_INIT") or time.monotonic() < _default_users_retry_at:
+        return
+    if not _default_users_lock.acquire(blocking=False):
+        return
+    try:
+        if not _default_users_ready and time.monotonic() >= _default_users_retry_at:
+            _default_users_ready = initialize_default_users()
+            if not _default_users_ready:
+                _default_users_retry_at = time.monotonic() + DEFAULT_USERS_RETRY_INTERVAL
+    finally:
+        _default_users_lock.release()
 
 # User management functions
-def create_user(username: str, password: str, role: str):
-    """Create a new user with hashed password in users container"""
-    hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+@lru_cache(maxsize=None)
+def _dummy_hash():
+    """Hash compared against when a username does not exist; built on first use, not at import"""
+    return bcrypt.hashpw(b"dummy-password", bcrypt.gensalt(rounds=BCRYPT_ROUNDS))
+
+def create_user(username: str, password: str, role: str, user_id: str = None):
+    """Create a new user with hashed password in users container.
+
+    When user_id is given it is used as both id and partition key and the
+    document is only created if it does not already exist.
+    """
+    try:
+        return _insert_user(username, password, role, user_id)
+    except Exception as e:
+        logger.error("Error creating user: %s", e)
+        return None
+
+def _insert_user(username: str, password: str, role: str, user_id: str = None):
+    """create_user that raises on write errors; None only when user_id already exists"""
+    hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode('utf-8')
     
     user_data = {
-        "id": str(uuid.uuid4()),
-        "user_id": str(uuid.uuid4()),  # Add user_id field for partitioning
+        "id": user_id or str(uuid.uuid4()),
+        "user_id": user_id or str(uuid.uuid4()),  # Add user_id field for partitioning
         "username": username,
         "password": hashed_password,
         "role": role,
         "created_at": datetime.now(timezone.utc).isoformat()  # Fixed
     }
     
+    # Pointer first: logins treat a missing pointer as a missing user, while a pointer
+    # left behind by a failed user write only resolves to "not found"
+    save_username_index(user_data)
     try:
-        get_users_container().upsert_item(user_data)
-        return user_data
-    except Exception as e:
-        print(f"Error creating user: {e}")
+        if user_id:
+            get_users_container().create_item(user_data)
+        else:
+            get_users_container().upsert_item(user_data)
+    except exceptions.CosmosResourceExistsError:
+        logger.info("User %s already exists", user_data["id"])
         return None
+    return user_data
 
 def authenticate_user(username: str, password: str):
     """Authenticate user credentials from users container"""
+    # Fallback in case startup could not create the default users
+    ensure_default_users()
+    password_bytes = password.encode('utf-8')
     user = get_user_by_username(username)
     
     if not user:
+        # Spend the same bcrypt work as a real check so response time
+        # does not reveal whether the username exists
+        bcrypt.checkpw(password_bytes, _dummy_hash())
         return None
     
-    if bcrypt.checkpw(password.encode('utf-8'), user['password'].encode('utf-8')):
+    if bcrypt.checkpw(password_bytes, user['password'].encode('utf-8')):
         # Return user data without password
         return {
             "id": user["id"],
@@ -180,6 +392,14 @@ def authenticate_user(username: str, password: str):
     
     return None
 
+async def create_user_async(username: str, password: str, role: str, user_id: str = None):
+    """Run create_user in a worker thread so bcrypt hashing does not block the event loop"""
+    return await asyncio.to_thread(create_user, username, password, role, user_id)
+
+async def authenticate_user_async(username: str, password: str):
+    """Run authenticate_user in a worker thread so bcrypt checking does not block the event loop"""
+    return await asyncio.to_thread(authenticate_user, username, password)
+
 def get_user_sessions(user_id: str):
     """Get all sessions for a specific user from sessions container"""
     query = "SELECT * FROM c WHERE c.user_id = @user_id"
@@ -193,12 +413,16 @@ def get_user_sessions(user_id: str):
         ))
         return sessions
     except Exception as e:
-        print(f"Error querying user sessions: {e}")
+        logger.error("Error querying user sessions: %s", e)
         return []
 
 def get_latest_user_session(user_id: str):
     """Get the most recent session for a user from sessions container"""
-    query = "SELECT TOP 1 * FROM c WHERE c.user_id = @user_id ORDER BY c._ts DESC"
+    # Callers only need the session id, not the full history
+    query = (
+        "SELECT TOP 1 c.id, c.session_id, c._ts FROM c "
+        "WHERE c.user_id = @user_id ORDER BY c._ts DESC"
+    )
     params = [{"name": "@user_id", "value": user_id}]
     
     try:
@@ -209,9 +433,24 @@ def get_latest_user_session(user_id: str):
         ))
         return sessions[0] if sessions else None
     except Exception as e:
-        print(f"Error querying latest user session: {e}")
+        logger.error("Error querying latest user session: %s", e)
         return None
 
+# System prompt cache so clear_session can reset without reading the session
+def _remember_system_prompt(session_id, system_prompt):
+    with _system_prompts_lock:
+        _system_prompts[session_id] = system_prompt
+        _system_prompts.move_to_end(session_id)
+        if len(_system_prompts) > SYSTEM_PROMPT_CACHE_SIZE:
+            _system_prompts.popitem(last=False)
+
+def _cached_system_prompt(session_id):
+    with _system_prompts_lock:
+        system_prompt = _system_prompts.get(session_id)
+        if system_prompt is not None:
+            _system_prompts.move_to_end(session_id)
+        return system_prompt
+
 # Enhanced session functions with user association
 def create_session(system_prompt=None, user_id=None):
     """Create a new session, optionally associated with a user"""
@@ -234,9 +473,10 @@ def create_session(system_prompt=None, user_id=None):
     
     try:
         get_container().upsert_item(session_data)
+        _remember_system_prompt(session_id, system_prompt)
         return session_id
     except Exception as e:
-        print(f"Error creating session: {e}")
+        logger.error("Error creating session: %s", e)
         return None
 
 def get_session(session_id):
@@ -244,6 +484,7 @@ def get_session(session_id):
         item = get_container().read_item(item=session_id, partition_key=session_id)
         if "system_prompt" not in item:
             item["system_prompt"] = DEFAULT_SYSTEM_PROMPT
+        _remember_system_prompt(session_id, item["system_prompt"])
         return item
     except exceptions.CosmosResourceNotFoundError:
         # Session doesn't exist, create a new one
@@ -255,7 +496,7 @@ def get_session(session_id):
             "summary": ""
         }
     except Exception as e:
-        print(f"Error getting session: {e}")
+        logger.error("Error getting session: %s", e)
         return {
             "id": session_id,
             "session_id": session_id,
@@ -265,15 +506,68 @@ def get_session(session_id):
         }
 
 def clear_session(session_id):
-    session = get_session(session_id)
-    session["history"] = [{"role": "system", "content": session.get("system_prompt", DEFAULT_SYSTEM_PROMPT)}]
-    session["summary"] = ""
-    get_container().upsert_item(session)
+    """Reset a session to its system prompt and return the cleared document"""
+    system_prompt = _cached_system_prompt(session_id)
+    if system_prompt is None:
+        system_prompt = get_session(session_id).get("system_prompt", DEFAULT_SYSTEM_PROMPT)
+    history = [{"role": "system", "content": system_prompt}]
+
+    try:
+        # Reset in place; no need to read and re-upload the whole document
+        # patch_item returns the updated document, so callers need no extra read
+        item = get_container().patch_item(
+            item=session_id,
+            partition_key=session_id,
+            patch_operations=[
+                {"op": "set", "path": "/history", "value": history},
+                {"op": "set", "path": "/summary", "value": ""}
+            ]
+        )
+        # Same defaults as get_session for sessions stored without a system prompt
+        if "system_prompt" not in item:
+            item["system_prompt"] = DEFAULT_SYSTEM_PROMPT
+        return item
+    except exceptions.CosmosResourceNotFoundError:
+        return get_container().upsert_item({
+            "id": session_id,
+            "session_id": session_id,
+            "history": history,
+            "system_prompt": system_prompt,
+            "summary": ""
+        })
+
+@lru_cache(maxsize=None)
+def get_encoding():
+    """Load the gpt-4o tokenizer once per process"""
+    try:
+        return tiktoken.encoding_for_model("gpt-4o")
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+@lru_cache(maxsize=4096)
+def _count_one(content):
+    """Token count of a single message; system prompts repeat on every call"""
+    return len(get_encoding().encode(content))
 
 def count_tokens(messages):
-    encoding = tiktoken.encoding_for_model("gpt-4o")
-    text = "".join([msg["content"] for msg in messages])
-    return len(encoding.encode(text))
+    system_tokens = sum(_count_one(msg["content"]) for msg in messages if msg["role"] == "system")
+    # Encode the remaining messages in parallel; encode_batch releases the GIL
+    pieces = [msg["content"] for msg in messages if msg["role"] != "system"]
+    tokens = get_encoding().encode_batch(pieces, num_threads=TOKENIZER_THREADS)
+    return system_tokens + sum(map(len, tokens))
+
+def cheap_token_estimate(messages):
+    """Rough token estimate (about 4 characters per token) without running the tokenizer"""
+    return sum(len(msg["content"]) for msg in messages) // 4
+
+def exceeds_token_budget(messages, limit=MAX_TOKENS):
+    """Check messages against a token budget, tokenizing only when the estimate is within 10%"""
+    estimate = cheap_token_estimate(messages)
+    if estimate < limit * 0.9:
+        return False
+    if estimate > limit * 1.1:
+        return True
+    return count_tokens(messages) > limit
 
 def summarize_messages(messages, client_openai=None, deployment=None):
     if not client_openai or not deployment or len(messages) < SUMMARY_TRIGGER:
@@ -299,7 +593,7 @@ def summarize_messages(messages, client_openai=None, deployment=None):
         )
         summary_text = completion.choices[0].message.content.strip()
     except Exception as e:
-        print("Error generating summary:", e)
+        logger.error("Error generating summary: %s", e)
         summary_text = ""
 
     summarized_messages = [system_prompt]  
@@ -318,28 +612,63 @@ def update_session(session_id, user_message, bot_response, user_id=None, client_
     history = session.get("history", [])
     summary = session.get("summary", "")
     
+    user_message_doc = {"role": "user", "content": user_message}
+    bot_message_doc = {"role": "assistant", "content": bot_response}
+    append_operations = [
+        {"op": "add", "path": "/history/-", "value": user_message_doc},
+        {"op": "add", "path": "/history/-", "value": bot_message_doc}
+    ]
+
     # Add user_id to session if provided and not already set
     if user_id and "user_id" not in session:
         session["user_id"] = user_id
+        append_operations.append({"op": "add", "path": "/user_id", "value": user_id})
 
-    history.append({"role": "user", "content": user_message})
-    history.append({"role": "assistant", "content": bot_response})
+    history.append(user_message_doc)
+    history.append(bot_message_doc)
 
-    if client_openai and deployment and len(history) >= SUMMARY_TRIGGER:
-        history, summary_text = summarize_messages(history, client_openai, deployment)
-        if summary_text:
-            summary = (summary + "\n" + summary_text).strip()
-        print("Summary triggered. Generated summary:", summary_text)
+    summary_text = ""
+    # Summarize only once the history outgrows the token budget, not on every turn past the trigger
+    if (client_openai and deployment and len(history) >= SUMMARY_TRIGGER
+            and history[0]["role"] == "system" and exceeds_token_budget(history)):
+        summarized, summary_text = summarize_messages(history, client_openai, deployment)
+
+    if summary_text:
+        summary = (summary + "\n" + summary_text).strip()
+        logger.debug("Summary triggered. Generated summary: %s", summary_text)
+        # Older turns are dropped only once the summary carries them; keep a window of recent ones
+        recent = summarized[2:][-MAX_HISTORY:]
+        dropped = len(history) - 1 - len(recent)
+        history = summarized[:2] + recent
+        patch_operations = (
+            [{"op": "remove", "path": "/history/1"}] * dropped
+            + [{"op": "add", "path": "/history/1", "value": summarized[1]}]
+            + append_operations
+            + [{"op": "set", "path": "/summary", "value": summary}]
+        )
+    else:
+        # No new summary: keep the system prompt, any earlier summary message,
+        # and the most recent MAX_HISTORY messages
+        head = 2 if summary else 1
+        dropped = max(0, len(history) - head - MAX_HISTORY)
+        history = history[:head] + history[head + dropped:]
+        patch_operations = [{"op": "remove", "path": f"/history/{head}"}] * dropped + append_operations
 
     session["history"] = history
     session["summary"] = summary
+
+    if len(patch_operations) <= MAX_PATCH_OPERATIONS:
+        # Append (and trim) in place instead of rewriting the whole document
+        try:
+            get_container().patch_item(
+                item=session_id,
+                partition_key=session_id,
+                patch_operations=patch_operations
+            )
+            return history
+        except exceptions.CosmosHttpResponseError as e:
+            # Session not stored yet or missing a history array
+            logger.debug("Patch failed, falling back to upsert: %s", e)
+
     get_container().upsert_item(session)
     return history
-
-# Initialize default users when this module is imported
-# But only if we can connect to Cosmos DB
-try:
-    initialize_default_users()
-except Exception as e:
-    print(f"Could not initialize default users during import: {e}")
-    print("This is normal if Key Vault authentication fails during import")
\ No newline at end of file
@@ -1,19 +1,43 @@
 import requests
 import os
+import atexit
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 import logging
-import json
+import orjson
+from xml.sax.saxutils import escape
 from azure.identity import DefaultAzureCredential
 from azure.keyvault.secrets import SecretClient
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 SERVICE_REGION = os.getenv("AZURE_SPEECH_REGION")
+# Speech REST endpoints, built once from the region
+STT_URL = f"https://{SERVICE_REGION}.stt.speech.microsoft.com/speech/recognition/conversation/cognitiveservices/v1"
+TTS_URL = f"https://{SERVICE_REGION}.tts.speech.microsoft.com/cognitiveservices/v1"
 KEYVAULT_NAME = os.getenv("KEYVAULT_NAME")
 
 # Cache for speech key
 _speech_key = None
 
+# Shared HTTP session so TLS connections to the Speech endpoints are reused
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=50))
+atexit.register(_SESSION.close)
+
+# (connect, read) timeouts for Speech REST calls
+REQUEST_TIMEOUT = (3, 30)
+
+# SSML envelope for TTS requests, encoded once
+_SSML_PREFIX = b"<speak version='1.0' xml:lang='en-US'><voice name='en-US-JennyNeural'>"
+_SSML_SUFFIX = b"</voice></speak>"
+
+def _preview(content, limit=500):
+    """Decode only the start of an error body for messages and logs"""
+    return content[:limit].decode("utf-8", "replace")
+
 def get_speech_key():
     """Lazy load speech key from environment first, then Key Vault"""
     global _speech_key
@@ -21,10 +45,10 @@ def get_speech_key():
         # Try environment variable first
         _speech_key = os.getenv("AZURE_SPEECH_KEY")
         if _speech_key:
-            print("Using Speech key from environment variable")
+            logger.debug("Using Speech key from environment variable")
             return _speech_key
             
-        print("Speech key not found in environment, trying Key Vault...")
+        logger.info("Speech key not found in environment, trying Key Vault...")
         
         # Fall back to Key Vault
         if not KEYVAULT_NAME:
@@ -35,10 +59,10 @@ def get_speech_key():
             credential = DefaultAzureCredential()
             secret_client = SecretClient(vault_url=keyvault_url, credential=credential)
             _speech_key = secret_client.get_secret("AZURE-SPEECH-KEY").value
-            print(" Successfully fetched Speech key from Key Vault")
+            logger.info("Successfully fetched Speech key from Key Vault")
         except Exception as e:
-            print(f" Error fetching Speech key from Key Vault: {e}")
-            print(" Make sure AZURE_SPEECH_KEY is set in local.settings.json")
+            logger.error("Error fetching Speech key from Key Vault: %s", e)
+            logger.error("Make sure AZURE_SPEECH_KEY is set in local.settings.json")
             raise ValueError("Could not get Speech key from environment or Key Vault")
     return _speech_key
 
@@ -50,9 +74,6 @@ def listen(audio_bytes=None):
         return "No audio data provided"
     
     try:
-        # API endpoint
-        url = f"https://{SERVICE_REGION}.stt.speech.microsoft.com/speech/recognition/conversation/cognitiveservices/v1"
-        
         # Headers
         headers = {
             "Ocp-Apim-Subscription-Key": get_speech_key(),  # Use getter function
@@ -62,21 +83,33 @@ def listen(audio_bytes=None):
         
         params = {"language": "en-US", "format": "detailed"}
         
-        response = requests.post(url, headers=headers, params=params, data=audio_bytes)
+        response = _SESSION.post(STT_URL, headers=headers, params=params, data=audio_bytes, timeout=REQUEST_TIMEOUT)
         
         if response.status_code == 200:
-            result = response.json()
+            result = orjson.loads(response.content)
             if result.get("RecognitionStatus") == "Success":
                 return result.get("DisplayText", "")
             else:
                 return f"Recognition failed: {result.get('RecognitionStatus')}"
         else:
-            return f"API error: {response.status_code} - {response.text}"
+            return f"API error: {response.status_code} - {_preview(response.content)}"
             
     except Exception as e:
-        logging.error(f"REST API speech recognition error: {e}")
+        logger.error("REST API speech recognition error: %s", e)
         return f"Error: {str(e)}"
 
+def _build_tts_request(text: str):
+    """Build the URL, headers and SSML body for a TTS request"""
+    headers = {
+        "Ocp-Apim-Subscription-Key": get_speech_key(),  # Use getter function
+        "Content-Type": "application/ssml+xml",
+        "X-Microsoft-OutputFormat": "riff-16khz-16bit-mono-pcm"
+    }
+    
+    # Escape the text so characters like & or < cannot break the SSML document
+    body = _SSML_PREFIX + escape(text).encode('utf-8') + _SSML_SUFFIX
+    return TTS_URL, headers, body
+
 def synthesize_text_to_audio(text: str):
     """
     Text-to-speech using Azure Speech REST API
@@ -85,30 +118,15 @@ def synthesize_text_to_audio(text: str):
         return None
         
     try:
-        url = f"https://{SERVICE_REGION}.tts.speech.microsoft.com/cognitiveservices/v1"
-        
-        headers = {
-            "Ocp-Apim-Subscription-Key": get_speech_key(),  # Use getter function
-            "Content-Type": "application/ssml+xml",
-            "X-Microsoft-OutputFormat": "riff-16khz-16bit-mono-pcm"
-        }
-        
-        ssml = f"""
-        <speak version='1.0' xml:lang='en-US'>
-            <voice name='en-US-JennyNeural'>
-                {text}
-            </voice>
-        </speak>
-        """
-        
-        response = requests.post(url, headers=headers, data=ssml.encode('utf-8'))
+        url, headers, body = _build_tts_request(text)
+        response = _SESSION.post(url, headers=headers, data=body, timeout=REQUEST_TIMEOUT)
         
         if response.status_code == 200:
-            return response.content
+            return response.content or None
         else:
-            logging.error(f"TTS API error: {response.status_code} - {response.text}")
+            logger.error("TTS API error: %s - %s", response.status_code, _preview(response.content))
             return None
             
     except Exception as e:
-        logging.error(f"REST API speech synthesis error: {e}")
-        return None
\ No newline at end of file
+        logger.error("REST API speech synthesis error: %s", e)
+        return None
@@ -1,76 +1,231 @@
 import os
-import json
+import csv
+import time
+import hashlib
+import itertools
+import unicodedata
+import asyncio
 import logging
+import threading
+import orjson
 import requests
-from session_store import clear_session, get_session
+import numpy as np
+import fastjsonschema
+from collections import Counter
+from urllib.parse import urlsplit
+from dataclasses import dataclass
+from concurrent.futures import Future, ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from session_store import clear_session
+from cache import TTLCache, get_or_set
+
+logger = logging.getLogger(__name__)
+
+# --- OpenStreetMap endpoints ---
+NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
+OVERPASS_URL = "https://overpass-api.de/api/interpreter"
+# Address tags joined, in order, into a place's display address
+OSM_ADDRESS_TAGS = ("addr:street", "addr:housenumber", "addr:city", "addr:country")
+# Places returned per city
+OSM_MAX_PLACES = 3
+# Cities per multi-city search; each uncached one costs a rate-limited Nominatim geocode
+OSM_MAX_CITIES = 5
+# Minified Overpass queries; only {lat} and {lon} are filled in per call
+_OVERPASS_FILTERS = (
+    'node["amenity"~"^(cafe|coffee_shop)$"](around:5000,{lat},{lon});'
+    'node["shop"="coffee"](around:5000,{lat},{lon});'
+)
+_OVERPASS_QUERY = "[out:json][timeout:25];(" + _OVERPASS_FILTERS + ");out tags %d;" % OSM_MAX_PLACES
+_OVERPASS_BATCH_BLOCK = "(" + _OVERPASS_FILTERS + ");out body %d;" % OSM_MAX_PLACES
+# (connect, read) timeouts in seconds, per attempt; see the Retry limits on _SESSION
+NOMINATIM_TIMEOUT = (5, 10)
+OVERPASS_TIMEOUT = (5, 25)
+OVERPASS_BATCH_TIMEOUT = (5, 60)
+
+# --- Shared HTTP session for the OSM APIs ---
+# Keep-alive connections to Nominatim and Overpass are reused across calls
+_SESSION = requests.Session()
+_SESSION.headers.update({"User-Agent": "CoffeeChatApp/1.0", "Accept": "application/json"})
+_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=int(os.getenv("OSM_POOL_MAXSIZE", "32")),  # raise to match worker concurrency
+    max_retries=Retry(
+        total=3,
+        connect=1,  # one reconnect attempt; an unreachable host gives up after ~2 connect timeouts
+        read=0,  # never resend after a read timeout; a slow Overpass is not retried
+        backoff_factor=0.3,
+        status_forcelist=[429, 502, 503, 504],
+        allowed_methods=frozenset({"GET", "POST"}),  # Overpass queries are read-only
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+))
+
+# --- Circuit breaker for the OSM APIs ---
+# After repeated failures, skip a host for a cool-down instead of waiting on timeouts.
+# State is per host so an overloaded Overpass does not block Nominatim.
+OSM_BREAKER_THRESHOLD = 5
+OSM_BREAKER_COOLDOWN = 60  # seconds
+_osm_breakers = {}  # host -> [consecutive failures, open until (monotonic)]
+_osm_request_counts = {}  # host -> Counter of outcomes ("200", "429", "error", "circuit_open", ...)
+_osm_breaker_lock = threading.Lock()
+
+# --- Request spacing ---
+# Nominatim's usage policy allows at most one request per second from the whole app;
+# requests to a listed host are spaced at least this far apart, across all threads
+OSM_MIN_INTERVAL = {urlsplit(NOMINATIM_URL).netloc: 1.0}  # host -> seconds
+_osm_next_slot = {}  # host -> earliest monotonic time the next request may start
+_osm_slot_lock = threading.Lock()
+
+def _wait_for_slot(host):
+    """Reserve the host's next request slot and sleep until it starts"""
+    interval = OSM_MIN_INTERVAL.get(host)
+    if not interval:
+        return
+    with _osm_slot_lock:
+        now = time.monotonic()
+        start = max(now, _osm_next_slot.get(host, 0.0))
+        _osm_next_slot[host] = start + interval
+    if start > now:
+        time.sleep(start - now)
+
+def _record_osm_outcome(host, ok, outcome):
+    with _osm_breaker_lock:
+        _osm_request_counts.setdefault(host, Counter())[outcome] += 1
+        breaker = _osm_breakers.setdefault(host, [0, 0.0])
+        if ok:
+            breaker[0] = 0
+            return
+        breaker[0] += 1
+        if breaker[0] >= OSM_BREAKER_THRESHOLD:
+            breaker[0] = 0
+            breaker[1] = time.monotonic() + OSM_BREAKER_COOLDOWN
+            logger.warning("OSM circuit open for %s for %ss after repeated failures", host, OSM_BREAKER_COOLDOWN)
+
+def _osm_request(method, url, **kwargs):
+    """Send an OSM request through the shared session, honoring the host's circuit breaker"""
+    host = urlsplit(url).netloc
+    breaker = _osm_breakers.get(host)
+    if breaker and time.monotonic() < breaker[1]:
+        with _osm_breaker_lock:
+            _osm_request_counts.setdefault(host, Counter())["circuit_open"] += 1
+        raise RuntimeError(f"{host} temporarily unavailable (circuit open)")
+    _wait_for_slot(host)
+    try:
+        response = _SESSION.request(method, url, **kwargs)
+    except requests.RequestException:
+        _record_osm_outcome(host, False, "error")
+        raise
+    # Throttling and server errors count against the breaker; 4xx/304 do not
+    status = response.status_code
+    _record_osm_outcome(host, status < 500 and status != 429, str(status))
+    return response
+
+def get_osm_stats():
+    """OSM request outcome counters and circuit breaker state, per host"""
+    now = time.monotonic()
+    with _osm_breaker_lock:
+        return {
+            host: {
+                "requests": dict(_osm_request_counts.get(host, {})),
+                "circuit_open": now < _osm_breakers.get(host, (0, 0.0))[1]
+            }
+            for host in _osm_request_counts.keys() | _osm_breakers.keys()
+        }
 
 # --- Function Definitions for AI ---
-def get_function_definitions():
-    """Define all available tools/functions for the AI"""
-    return [
-        {
-            "type": "function",
-            "function": {
-                "name": "clear_conversation",
-                "description": "Clear the current conversation history and start a fresh session",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "reason": {"type": "string", "description": "Why the conversation is being cleared"}
-                    },
-                    "required": [],
-                    "additionalProperties": False
-                }
+# Built once at import; the definitions never change at runtime
+_FUNCTION_DEFINITIONS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "clear_conversation",
+            "description": "Clear the current conversation history and start a fresh session",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "reason": {"type": "string", "description": "Why the conversation is being cleared"}
+                },
+                "required": [],
+                "additionalProperties": False
             }
-        },
-        {
-            "type": "function",
-            "function": {
-                "name": "find_coffee_shops",
-                "description": "Find up to 3 coffee shops near a specific city using OpenStreetMap APIs",  
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "city": {"type": "string", "description": "The city to search for coffee shops in"},
-                        "coffee_type": {
-                            "type": "string",
-                            "description": "Type of coffee shop preference",
-                            "enum": ["specialty", "cafe", "espresso_bar", "roastery", "any"],
-                            "default": "any"
-                        }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "find_coffee_shops",
+            "description": "Find up to 3 coffee shops near a specific city, or near each of several cities, using OpenStreetMap APIs",  
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "city": {
+                        "oneOf": [
+                            {"type": "string"},
+                            {"type": "array", "items": {"type": "string"}, "minItems": 1, "maxItems": OSM_MAX_CITIES}
+                        ],
+                        "description": "The city to search for coffee shops in, or a list of cities to search in one call"
                     },
-                    "required": ["city"],
-                    "additionalProperties": False
-                }
+                    "coffee_type": {
+                        "type": "string",
+                        "description": "Type of coffee shop preference",
+                        "enum": ["specialty", "cafe", "espresso_bar", "roastery", "any"],
+                        "default": "any"
+                    }
+                },
+                "required": ["city"],
+                "additionalProperties": False
             }
-        },
-        {
-            "type": "function",
-            "function": {
-                "name": "calculate_brew_ratio",
-                "description": "Calculate coffee to water ratio and provide brewing advice",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "coffee_amount": {"type": "number", "description": "Amount of coffee in grams"},
-                        "water_amount": {"type": "number", "description": "Amount of water in grams or ml"},
-                        "brew_method": {
-                            "type": "string",
-                            "description": "Brewing method being used",
-                            "enum": ["pour_over", "french_press", "espresso", "aeropress", "cold_brew", "moka_pot"]
-                        }
-                    },
-                    "required": ["coffee_amount", "water_amount"],
-                    "additionalProperties": False
-                }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "calculate_brew_ratio",
+            "description": "Calculate coffee to water ratio and provide brewing advice",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "coffee_amount": {"type": "number", "description": "Amount of coffee in grams"},
+                    "water_amount": {"type": "number", "description": "Amount of water in grams or ml"},
+                    "brew_method": {
+                        "type": "string",
+                        "description": "Brewing method being used",
+                        "enum": ["pour_over", "french_press", "espresso", "aeropress", "cold_brew", "moka_pot"]
+                    }
+                },
+                "required": ["coffee_amount", "water_amount"],
+                "additionalProperties": False
             }
         }
-    ]
+    }
+]
+
+_FUNCTION_DEFINITIONS_BYTES = orjson.dumps(_FUNCTION_DEFINITIONS)
+_FUNCTION_DEFINITIONS_JSON = _FUNCTION_DEFINITIONS_BYTES.decode()
+
+# Argument validators compiled once from the parameter schemas
+_VALIDATORS = {
+    definition["function"]["name"]: fastjsonschema.compile(definition["function"]["parameters"])
+    for definition in _FUNCTION_DEFINITIONS
+}
+
+def get_function_definitions():
+    """Define all available tools/functions for the AI"""
+    return _FUNCTION_DEFINITIONS
+
+def get_function_definitions_json():
+    """Function definitions pre-serialized to a JSON string"""
+    return _FUNCTION_DEFINITIONS_JSON
+
+def get_function_definitions_bytes():
+    """Function definitions pre-serialized to UTF-8 JSON, ready for an HTTP body"""
+    return _FUNCTION_DEFINITIONS_BYTES
 
 # --- Function Implementations ---
 def clear_conversation_fn(session_id, reason=None):
-    clear_session(session_id)
-    fresh_session = get_session(session_id)
+    fresh_session = clear_session(session_id)
     return {
         "success": True,
         "message": f"Conversation cleared. Reason: {reason or 'User requested to start fresh'}",
@@ -84,11 +239,76 @@ def clear_conversation_fn(session_id, reason=None):
         }
     }
 
+# --- Result caches ---
+SEARCH_CACHE_TTL = 24 * 60 * 60  # seconds
+SEARCH_CACHE_SIZE = 1024
+GEOCODE_CACHE_TTL = 24 * 60 * 60  # city coordinates are effectively static
+GEOCODE_CACHE_SIZE = 1024
+_search_cache = TTLCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL)  # "coffee:poi:<hash>" -> result
+_geocode_cache = TTLCache(GEOCODE_CACHE_SIZE, GEOCODE_CACHE_TTL)  # "coffee:geocode:<city>" -> (lat, lon, display_name)
+
+def _normalize_city(city):
+    return " ".join(city.lower().split())
+
+def _search_cache_key(city, coffee_type):
+    """Shared-cache key; hashed because city lists can be arbitrarily long"""
+    if isinstance(city, (list, tuple)):
+        cities = [_normalize_city(c) for c in city]
+    else:
+        cities = _normalize_city(city)
+    digest = hashlib.blake2b(orjson.dumps([cities, coffee_type]), digest_size=16).hexdigest()
+    return "coffee:poi:" + digest
+
+def get_cache_stats():
+    """Hit/miss counters for the tool caches"""
+    return {"search": _search_cache.stats(), "geocode": _geocode_cache.stats()}
+
+# Searches currently running, so concurrent identical requests share one lookup (cached or live)
+_inflight = {}  # cache key -> Future
+_inflight_lock = threading.Lock()
+
 def find_coffee_shops_fn(city, coffee_type="any"):
+    """Find coffee shops in a city, or in each city of a list"""
+    key = _search_cache_key(city, coffee_type)
+    # Cache lookups happen once, inside get_or_set, so hit/miss counts stay exact
+    with _inflight_lock:
+        future = _inflight.get(key)
+        leader = future is None
+        if leader:
+            future = _inflight[key] = Future()
+    if not leader:
+        return future.result()
+
     try:
+        result = _search_coffee_shops(key, city, coffee_type)
+        future.set_result(result)
+        return result
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+
+def _live_search(city, coffee_type):
+    """Run the OSM search; None unless it found places"""
+    if isinstance(city, (list, tuple)):
+        osm_result = try_osm_search_batch(list(city), coffee_type)
+    else:
         osm_result = try_osm_search(city, coffee_type)
-        if osm_result and osm_result.get("places"):
+    return osm_result if osm_result and osm_result.get("places") else None
+
+def _search_coffee_shops(key, city, coffee_type):
+    """Search through the shared cache, falling back to a stale local result"""
+    try:
+        osm_result = get_or_set(key, SEARCH_CACHE_TTL, lambda: _live_search(city, coffee_type), local=_search_cache)
+        if osm_result:
             return osm_result
+
+        stale = _search_cache.get_stale(key)
+        if stale:
+            # Live search failed; an expired answer beats no answer
+            return {**stale, "stale": True}
             
         return {
             "error": "Live search unavailable",
@@ -97,80 +317,198 @@ def find_coffee_shops_fn(city, coffee_type="any"):
         }
 
     except Exception as e:
-        logging.error(f"All search methods failed: {str(e)}")
+        logger.error("All search methods failed: %s", e)
         return {"error": f"Search failed: {str(e)}", "places": []}
 
+# --- Conditional GET cache ---
+# Validators and parsed bodies of earlier responses; a 304 reuses the body
+CONDITIONAL_CACHE_SIZE = 512
+_conditional_cache = {}  # (url, params) -> (etag, last_modified, data), oldest first
+_conditional_cache_lock = threading.Lock()
+
+def _conditional_get(url, params, timeout):
+    """GET JSON with If-None-Match/If-Modified-Since, reusing the parsed body on 304"""
+    key = (url, tuple(sorted(params.items())))
+    cached = _conditional_cache.get(key)
+    headers = {}
+    if cached:
+        if cached[0]:
+            headers["If-None-Match"] = cached[0]
+        if cached[1]:
+            headers["If-Modified-Since"] = cached[1]
+
+    response = _osm_request("GET", url, params=params, headers=headers, timeout=timeout)
+    if response.status_code == 304 and cached:
+        return cached[2]
+    if response.status_code != 200:
+        return None
+
+    data = orjson.loads(response.content)
+    etag = response.headers.get("ETag")
+    last_modified = response.headers.get("Last-Modified")
+    if etag or last_modified:
+        with _conditional_cache_lock:
+            _conditional_cache.pop(key, None)
+            _conditional_cache[key] = (etag, last_modified, data)
+            if len(_conditional_cache) > CONDITIONAL_CACHE_SIZE:
+                _conditional_cache.pop(next(iter(_conditional_cache)))
+    return data
+
+# Dedicated pool for blocking OSM searches so they cannot starve the default executor
+_HTTP_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix="osm-http")
+
+async def find_coffee_shops_async(city, coffee_type="any"):
+    """Async variant of find_coffee_shops_fn for callers running an event loop"""
+    # The OSM lookup is blocking I/O; run it off the event loop
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_HTTP_EXECUTOR, find_coffee_shops_fn, city, coffee_type)
+
+# --- Optional local city table ---
+# CSV with name, country, lat, lon, population columns (e.g. exported from GeoNames
+# cities500); when configured, known cities skip the Nominatim geocode entirely
+CITY_COORDS_PATH = os.getenv("CITY_COORDS_PATH")
+_city_coords = None
+_city_coords_lock = threading.Lock()
+
+def _city_key(city):
+    return unicodedata.normalize("NFKD", " ".join(city.split())).casefold()
+
+def _load_city_coords():
+    """Read the city table once; the most populous city wins for duplicate names"""
+    coords = {}
+    populations = {}
+    try:
+        with open(CITY_COORDS_PATH, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                key = _city_key(row["name"])
+                population = int(row.get("population") or 0)
+                if population >= populations.get(key, -1):
+                    populations[key] = population
+                    coords[key] = (float(row["lat"]), float(row["lon"]), f"{row['name']}, {row['country']}")
+        logger.info("Loaded %d cities from %s", len(coords), CITY_COORDS_PATH)
+    except (OSError, KeyError, ValueError) as e:
+        logger.error("Could not load city table %s: %s", CITY_COORDS_PATH, e)
+    return coords
+
+def _local_geocode(city):
+    global _city_coords
+    if not CITY_COORDS_PATH:
+        return None
+    if _city_coords is None:
+        with _city_coords_lock:
+            if _city_coords is None:
+                _city_coords = _load_city_coords()
+    return _city_coords.get(_city_key(city))
+
+def _osm_geocode(city):
+    """Resolve a city name to (lat, lon, display_name), cached per city"""
+    location = _local_geocode(city)
+    if location:
+        return location
+    key = "coffee:geocode:" + _normalize_city(city)
+    return get_or_set(key, GEOCODE_CACHE_TTL, lambda: _fetch_geocode(city), local=_geocode_cache)
+
+def _fetch_geocode(city):
+    """Resolve a city name to (lat, lon, display_name) with Nominatim"""
+    geo_params = {
+        "q": city,  
+        "format": "json",
+        "limit": 1
+    }
+    
+    geo_data = _conditional_get(NOMINATIM_URL, geo_params, timeout=NOMINATIM_TIMEOUT)
+    if not geo_data:
+        return None
+    
+    return geo_data[0]["lat"], geo_data[0]["lon"], geo_data[0].get("display_name", "Unknown location")
+
+@dataclass(slots=True, frozen=True)
+class Place:
+    """A coffee shop returned to the model; orjson serializes it without an intermediate dict.
+
+    Frozen because cached search results hand the same instances to every caller.
+    """
+    name: str
+    address: str
+    type: str
+    city: str
+    source: str = "openstreetmap"
+
+def _osm_place(element, city):
+    """Convert an Overpass element into a Place"""
+    tags = element.get("tags", {})
+    return Place(
+        tags.get("name", "Coffee Shop"),
+        ", ".join(filter(None, map(tags.get, OSM_ADDRESS_TAGS))) or "Address not available",
+        tags.get("amenity", "cafe"),
+        city
+    )
+
+def _nominatim_place(result, city):
+    """Convert a Nominatim POI result into a Place"""
+    address = result.get("address", {})
+    locality = address.get("city") or address.get("town") or address.get("village")
+    parts = (address.get("road"), address.get("house_number"), locality, address.get("country"))
+    return Place(
+        result.get("name") or "Coffee Shop",
+        ", ".join(filter(None, parts)) or "Address not available",
+        result.get("type", "cafe"),
+        city
+    )
+
+def _nominatim_poi_search(city):
+    """Find cafes with one Nominatim special-phrase query, skipping the Overpass round trip"""
+    params = {
+        "q": f"cafe in {city}",
+        "format": "jsonv2",
+        "addressdetails": 1,
+        "layer": "poi",  # only POI matches; streets and areas named like cafes are skipped
+        "limit": OSM_MAX_PLACES
+    }
+    results = _conditional_get(NOMINATIM_URL, params, timeout=NOMINATIM_TIMEOUT)
+    if not results:
+        return None
+    
+    places = [_nominatim_place(result, city) for result in results]
+    address = results[0].get("address", {})
+    locality = address.get("city") or address.get("town") or address.get("village") or city
+    return {
+        "city": city,
+        "places_found": len(places),
+        "places": places,
+        "source": "openstreetmap",
+        "actual_location": ", ".join(filter(None, (locality, address.get("country"))))
+    }
+
 def try_osm_search(city, coffee_type):
     """Fallback to OpenStreetMap"""
     try:
-        logging.info(f" Falling back to OpenStreetMap for {city}")
+        logger.info("Falling back to OpenStreetMap for %s", city)
         
+        # One request covers most cities; geocode + Overpass only when it finds nothing.
+        # The geocode is not started alongside it: that would double the load on
+        # Nominatim, whose usage policy allows one request per second.
+        fused = _nominatim_poi_search(city)
+        if fused:
+            return fused
         
-        geo_url = "https://nominatim.openstreetmap.org/search"
-        geo_params = {
-            "q": city,  
-            "format": "json",
-            "limit": 1
-        }
-        
-        geo_response = requests.get(geo_url, params=geo_params, timeout=10, 
-                                  headers={'User-Agent': 'CoffeeChatApp/1.0'})
-        
-        if geo_response.status_code != 200:
+        location = _osm_geocode(city)
+        if not location:
             return None
-            
-        geo_data = geo_response.json()
-        if not geo_data:
-            return None
-            
-        lat = geo_data[0]["lat"]
-        lon = geo_data[0]["lon"]
-        
-        
-        found_location = geo_data[0].get("display_name", "Unknown location")
-        logging.info(f"OSM geocoded '{city}' to: {found_location}")
+        lat, lon, found_location = location
+        logger.debug("OSM geocoded '%s' to: %s", city, found_location)
         
         
-        overpass_query = f"""
-        [out:json][timeout:25];
-        (
-          node["amenity"="cafe"](around:5000,{lat},{lon});
-          node["shop"="coffee"](around:5000,{lat},{lon});
-          node["amenity"="coffee_shop"](around:5000,{lat},{lon});
-        );
-        out body;
-        """
-        
-        overpass_url = "https://overpass-api.de/api/interpreter"
-        response = requests.post(overpass_url, data={"data": overpass_query}, timeout=25)
+        overpass_query = _OVERPASS_QUERY.format(lat=lat, lon=lon)
+        response = _osm_request("POST", OVERPASS_URL, data={"data": overpass_query}, timeout=OVERPASS_TIMEOUT)
         
         if response.status_code != 200:
             return None
             
-        data = response.json()
-        places = []
-        
-        for element in data.get("elements", [])[:3]:
-            tags = element.get("tags", {})
-            name = tags.get("name", "Coffee Shop")
-            address_parts = []
-            if tags.get("addr:street"):
-                address_parts.append(tags.get("addr:street"))
-            if tags.get("addr:housenumber"):
-                address_parts.append(tags.get("addr:housenumber"))
-            if tags.get("addr:city"):
-                address_parts.append(tags.get("addr:city"))
-            if tags.get("addr:country"):
-                address_parts.append(tags.get("addr:country"))
-                
-            address = ", ".join(address_parts) if address_parts else "Address not available"
-            
-            places.append({
-                "name": name,
-                "address": address,
-                "type": tags.get("amenity", "cafe"),
-                "source": "openstreetmap"
-            })
+        data = orjson.loads(response.content)
+        # "out tags N" caps the result server-side and omits coordinates;
+        # islice guards against mirrors that ignore the limit
+        places = [_osm_place(element, city) for element in itertools.islice(data.get("elements", ()), OSM_MAX_PLACES)]
         
         return {
             "city": city, 
@@ -181,40 +519,169 @@ def try_osm_search(city, coffee_type):
         }
         
     except Exception as e:
-        logging.error(f"OSM fallback also failed: {str(e)}")
+        logger.error("OSM fallback also failed: %s", e)
         return None
 
+def try_osm_search_batch(cities, coffee_type):
+    """Search several cities with one Overpass request instead of one per city"""
+    if not cities:
+        return None
+    try:
+        # One city at a time: uncached cities each cost a Nominatim request
+        locations = [_osm_geocode(city) for city in cities]
+        found = [(city, location) for city, location in zip(cities, locations) if location]
+        if not found:
+            return None
+        
+        # One union per city, each capped at OSM_MAX_PLACES nodes; "out body" keeps coordinates
+        blocks = "".join(_OVERPASS_BATCH_BLOCK.format(lat=lat, lon=lon) for _, (lat, lon, _) in found)
+        overpass_query = f"[out:json][timeout:60];{blocks}"
+        
+        response = _osm_request("POST", OVERPASS_URL, data={"data": overpass_query}, timeout=OVERPASS_BATCH_TIMEOUT)
+        
+        if response.status_code != 200:
+            return None
+        
+        centroids = [(float(lat), float(lon)) for _, (lat, lon, _) in found]
+        places_by_city = [[] for _ in found]
+        for element in orjson.loads(response.content).get("elements", []):
+            # Attribute each node to the nearest geocoded city
+            nearest = min(
+                range(len(centroids)),
+                key=lambda i: (element["lat"] - centroids[i][0]) ** 2 + (element["lon"] - centroids[i][1]) ** 2
+            )
+            places_by_city[nearest].append(_osm_place(element, found[nearest][0]))
+        
+        results = [
+            {
+                "city": city,
+                "places_found": len(places),
+                "places": places,
+                "source": "openstreetmap",
+                "actual_location": location[2]
+            }
+            for (city, location), places in zip(found, places_by_city)
+        ]
+        return {
+            "cities": results,
+            "places": [place for result in results for place in result["places"]],
+            "source": "openstreetmap"
+        }
+    
+    except Exception as e:
+        logger.error("OSM batch search failed: %s", e)
+        return None
+
+# --- Brew ratio tables ---
+# brew_method -> (lowest ratio, highest ratio, suffix appended to the advice when in range)
+_BREW_RANGES = {
+    "espresso": (1.5, 2.5, " - Good espresso ratio!"),
+    "pour_over": (15.0, 17.0, " - Ideal pour over range!"),
+    "french_press": (12.0, 15.0, " - Perfect French press ratio!")
+}
+
+def _advice_formatter(name=None, suffix=""):
+    """Advice builder with the method's constant text baked in, so each call is one f-string"""
+    method_text = f" for {name}" if name else ""
+    def format_advice(ratio, in_range):
+        return f"Brew ratio: 1:{ratio:.1f} (coffee:water){method_text}{suffix if in_range else ''}"
+    return format_advice
+
+# One formatter per brew method in the tool schema
+_ADVICE_FORMATTERS = {
+    method: _advice_formatter(method.replace('_', ' ').title(), _BREW_RANGES[method][2] if method in _BREW_RANGES else "")
+    for method in ("pour_over", "french_press", "espresso", "aeropress", "cold_brew", "moka_pot")
+}
+_PLAIN_ADVICE = _advice_formatter()
+
+def _formatter_for(brew_method):
+    if not brew_method:
+        return _PLAIN_ADVICE
+    return _ADVICE_FORMATTERS.get(brew_method) or _advice_formatter(brew_method.replace('_', ' ').title())
+
 def calculate_brew_ratio_fn(coffee_amount, water_amount, brew_method=None):
     ratio = water_amount / coffee_amount
-    advice = f"Brew ratio: 1:{ratio:.1f} (coffee:water)"
-    if brew_method:
-        advice += f" for {brew_method.replace('_', ' ').title()}"
-    if brew_method == "espresso" and 1.5 <= ratio <= 2.5:
-        advice += " - Good espresso ratio!"
-    elif brew_method == "pour_over" and 15 <= ratio <= 17:
-        advice += " - Ideal pour over range!"
-    elif brew_method == "french_press" and 12 <= ratio <= 15:
-        advice += " - Perfect French press ratio!"
+    brew_range = _BREW_RANGES.get(brew_method)
+    in_range = brew_range is not None and brew_range[0] <= ratio <= brew_range[1]
+    advice = _formatter_for(brew_method)(ratio, in_range)
     return {"coffee_amount": coffee_amount, "water_amount": water_amount, "ratio": round(ratio,1), "advice": advice}
 
+def calculate_brew_ratio_batch(coffee_amounts, water_amounts, brew_methods=None):
+    """calculate_brew_ratio_fn over many (coffee, water) pairs, with the arithmetic vectorized"""
+    coffee = np.asarray(coffee_amounts, dtype=np.float64)
+    water = np.asarray(water_amounts, dtype=np.float64)
+    ratios = water / coffee
+    methods = list(brew_methods) if brew_methods is not None else [None] * len(ratios)
+    
+    # Methods without a band get NaN bounds, which never compare as in range
+    bands = [_BREW_RANGES.get(method, (np.nan, np.nan, None)) for method in methods]
+    low = np.fromiter((band[0] for band in bands), dtype=np.float64, count=len(bands))
+    high = np.fromiter((band[1] for band in bands), dtype=np.float64, count=len(bands))
+    in_range = (ratios >= low) & (ratios <= high)
+    
+    results = []
+    for coffee_amount, water_amount, method, ratio, good in zip(
+        coffee_amounts, water_amounts, methods, ratios.tolist(), in_range.tolist()
+    ):
+        advice = _formatter_for(method)(ratio, good)
+        results.append({"coffee_amount": coffee_amount, "water_amount": water_amount, "ratio": round(ratio, 1), "advice": advice})
+    return results
+
 # --- Map function names to implementations ---
-FUNCTION_MAP = {
-    "clear_conversation": clear_conversation_fn,
-    "find_coffee_shops": find_coffee_shops_fn,
-    "calculate_brew_ratio": calculate_brew_ratio_fn
+# name -> (implementation, whether it takes the session_id first)
+_DISPATCH = {
+    "clear_conversation": (clear_conversation_fn, True),
+    "find_coffee_shops": (find_coffee_shops_fn, False),
+    "calculate_brew_ratio": (calculate_brew_ratio_fn, False)
 }
+FUNCTION_MAP = {name: entry[0] for name, entry in _DISPATCH.items()}
+
+# Tools that mutate session state; run one at a time, in call order
+_SERIAL_TOOLS = frozenset({"clear_conversation"})
+
+# Pool for running independent tool calls in parallel
+_EXECUTOR = ThreadPoolExecutor(max_workers=int(os.getenv("TOOL_POOL", "32")), thread_name_prefix="tool")
+
+def _resolve_call(function_name, function_args, session_id):
+    """Look up and validate a tool call; returns (fn, needs_session_id, None) or (None, None, error)"""
+    entry = _DISPATCH.get(function_name)
+    if entry is None:
+        return None, None, {"error": f"Function '{function_name}' not found"}
+    fn, needs_session_id = entry
+    if needs_session_id and not session_id:
+        return None, None, {"error": f"Function '{function_name}' requires a session"}
+    # Reject malformed model output up front instead of via a TypeError; fills schema defaults in place
+    try:
+        _VALIDATORS[function_name](function_args)
+    except fastjsonschema.JsonSchemaException as e:
+        return None, None, {"error": f"Function '{function_name}' got invalid arguments: {e.message}"}
+    return fn, needs_session_id, None
 
 # --- Central execute_function for AI ---
 def execute_function(function_name, function_args, session_id=None):
-    logging.info(f"[DEBUG] execute_function called: {function_name} with args: {function_args}")
-    if function_name in FUNCTION_MAP:
-        try:
-            if function_name == "clear_conversation" and session_id:
-                return FUNCTION_MAP[function_name](session_id, **function_args)
-            else:
-                return FUNCTION_MAP[function_name](**function_args)
-        except Exception as e:
-            logging.error(f"Error executing function '{function_name}': {str(e)}")
-            return {"error": f"Function '{function_name}' execution failed: {str(e)}"}
-    else:
-        return {"error": f"Function '{function_name}' not found"}
\ No newline at end of file
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("execute_function called: %s with args: %s", function_name, function_args)
+    fn, needs_session_id, error = _resolve_call(function_name, function_args, session_id)
+    if error:
+        return error
+    try:
+        return fn(session_id, **function_args) if needs_session_id else fn(**function_args)
+    except Exception as e:
+        logger.error("Error executing function '%s': %s", function_name, e)
+        return {"error": f"Function '{function_name}' execution failed: {str(e)}"}
+
+def execute_functions(calls, session_id=None):
+    """Run a batch of (function_name, function_args) calls; independent ones in parallel.
+
+    Results come back in call order, so latency is the slowest call rather than the sum.
+    """
+    if len(calls) == 1:
+        return [execute_function(calls[0][0], calls[0][1], session_id)]
+    futures = [
+        None if name in _SERIAL_TOOLS else _EXECUTOR.submit(execute_function, name, args, session_id)
+        for name, args in calls
+    ]
+    return [
+        execute_function(name, args, session_id) if future is None else future.result()
+        for (name, args), future in zip(calls, futures)
+    ]